@@ -1,87 +1,691 @@
+import asyncio
+import base64
+import functools
+import json
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+
+import anyio
+from cachetools import TTLCache
 from databricks import sql
 from dotenv import load_dotenv
 
 load_dotenv()
 
-
-def _db_cfg():
-    return {
-        "server_hostname": os.environ["DATABRICKS_SERVER_HOSTNAME"],
-        "http_path": os.environ["DATABRICKS_HTTP_PATH"],
-        "access_token": os.environ["DATABRICKS_TOKEN"],
-        "catalog": os.getenv("DATABRICKS_CATALOG", "precodahora"),
-        "gold_table": os.getenv("DATABRICKS_GOLD_TABLE", "gold_latest"),
-        "silver_table": os.getenv("DATABRICKS_SILVER_TABLE", "silver_prices"),
-    }
+# --------------------------------------------------------------------------------------
+# Connection pool
+# --------------------------------------------------------------------------------------
+# Cada sql.connect() custa handshake TCP+TLS + validação do token no warehouse.
+# Mantemos um pool LIFO (conexão mais quente primeiro) com limite de conexões abertas.
+_POOL_SIZE = int(os.getenv("DATABRICKS_POOL_SIZE", "8"))
+_POOL_TIMEOUT_S = 30
+_MAX_LIFETIME_S = 30 * 60
+_IDLE_TIMEOUT_S = 10 * 60
+_VALIDATE_AFTER_IDLE_S = 60
+_MAX_DOWNLOAD_THREADS = int(os.getenv("DATABRICKS_MAX_DOWNLOAD_THREADS", "8"))
+
+_POOL: "queue.LifoQueue" = queue.LifoQueue(maxsize=_POOL_SIZE)
+# Uma vaga por conexão emprestada: é liberada na devolução *e* no descarte, então quem
+# está esperando acorda e abre uma conexão nova quando outra é derrubada por erro.
+_POOL_SLOTS = threading.BoundedSemaphore(_POOL_SIZE)
+
+# Threads dedicadas às chamadas bloqueantes do querydb (independente do pool padrão do Starlette)
+_THREAD_LIMIT = int(os.getenv("DATABRICKS_THREAD_LIMIT", "64"))
+_LIMITER: "anyio.CapacityLimiter | None" = None
+
+
+@dataclass(frozen=True, slots=True)
+class DbCfg:
+    server_hostname: str
+    http_path: str
+    access_token: str
+    catalog: str
+    gold_table: str
+    silver_table: str
+
+
+@functools.lru_cache(maxsize=1)
+def _db_cfg() -> DbCfg:
+    # o ambiente não muda em runtime: lê uma vez e reaproveita
+    return DbCfg(
+        server_hostname=os.environ["DATABRICKS_SERVER_HOSTNAME"],
+        http_path=os.environ["DATABRICKS_HTTP_PATH"],
+        access_token=os.environ["DATABRICKS_TOKEN"],
+        catalog=os.getenv("DATABRICKS_CATALOG", "precodahora"),
+        gold_table=os.getenv("DATABRICKS_GOLD_TABLE", "gold_latest"),
+        silver_table=os.getenv("DATABRICKS_SILVER_TABLE", "silver_prices"),
+    )
 
 
 def _connect():
     cfg = _db_cfg()
     return sql.connect(
-        server_hostname=cfg["server_hostname"],
-        http_path=cfg["http_path"],
-        access_token=cfg["access_token"],
+        server_hostname=cfg.server_hostname,
+        http_path=cfg.http_path,
+        access_token=cfg.access_token,
+        user_agent_entry="fastapi-pool/1.0",
+        # parâmetros nativos (?): o texto da SQL fica estável e os valores vão à parte
+        use_inline_params=False,
+        # resultados grandes vêm em chunks Arrow baixados em paralelo do storage (cloud fetch)
+        use_cloud_fetch=True,
+        max_download_threads=_MAX_DOWNLOAD_THREADS,
+        session_configuration={"STATEMENT_TIMEOUT": "120"},
+        _socket_timeout=30,
+        _enable_v3_retries=True,
+        _retry_stop_after_attempts_count=5,
+        _retry_delay_min=0.5,
+    )
+
+
+def _is_stale(conn, now: float) -> bool:
+    return (
+        now - conn._created_at > _MAX_LIFETIME_S
+        or now - conn._last_used > _IDLE_TIMEOUT_S
     )
 
 
-def querydb(sql_text: str, params=None, as_df: bool = False, **kwargs):
+def _validate(conn) -> bool:
+    # conexão ociosa pode ter sido derrubada pelo LB/servidor: testa antes da query real
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _discard(conn):
+    # fecha uma conexão emprestada e libera a vaga dela
+    _close(conn)
+    _POOL_SLOTS.release()
+
+
+def _checkout():
+    if not _POOL_SLOTS.acquire(timeout=_POOL_TIMEOUT_S):
+        raise TimeoutError(
+            f"Pool do Databricks esgotado ({_POOL_SIZE} conexões) após {_POOL_TIMEOUT_S}s"
+        )
+
+    # com a vaga garantida: reaproveita uma conexão ociosa ou abre uma nova
+    try:
+        while True:
+            try:
+                conn = _POOL.get_nowait()
+            except queue.Empty:
+                conn = _connect()
+                conn._created_at = conn._last_used = time.monotonic()
+                return conn
+
+            now = time.monotonic()
+            if _is_stale(conn, now):
+                _close(conn)
+                continue
+            if now - conn._last_used > _VALIDATE_AFTER_IDLE_S and not _validate(conn):
+                _close(conn)
+                continue
+            return conn
+    except BaseException:
+        _POOL_SLOTS.release()
+        raise
+
+
+@contextmanager
+def _acquire():
+    """
+    Empresta uma conexão do pool.
+
+    Em caso de erro durante o uso, a conexão é fechada em vez de devolvida.
+    """
+    conn = _checkout()
+    try:
+        yield conn
+    except BaseException:
+        _discard(conn)
+        raise
+    conn._last_used = time.monotonic()
+    # devolve antes de liberar a vaga: o próximo a entrar já encontra a conexão ociosa
+    _POOL.put_nowait(conn)
+    _POOL_SLOTS.release()
+
+
+def querydb(
+    sql_text: str,
+    params=None,
+    as_df: bool = False,
+    as_records: bool = True,
+    as_arrow: bool = False,
+    **kwargs,
+):
     """
     Executa SQL no Databricks SQL Warehouse.
 
     Aceita:
       - params=...
       - parameters=... (alias)
+
+    Formato do retorno:
+      - as_df=True: pandas.DataFrame
+      - as_records=True (padrão): lista de dicts
+      - as_records=False: {"columns": [...], "rows": [[...], ...]} (colunar, sem dict por linha)
+
+    as_arrow=True lê o resultado com fetchall_arrow() (buffers colunares do Arrow, sem
+    desserializar linha a linha em Python). DataFrames sempre usam esse caminho.
     """
     if params is None:
         params = kwargs.get("parameters")
 
-    params = params or ()
+    # sem parâmetros, o conector nem monta a lista de bind
+    params = list(params) if params else None
+    use_arrow = as_arrow or as_df
 
-    conn = _connect()
-    try:
-        cur = conn.cursor()
-        cur.execute(sql_text, params)
+    tbl = None
+    cols, rows = [], []
+    with _acquire() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql_text, params)
 
-        cols = [c[0] for c in cur.description] if cur.description else []
-        rows = cur.fetchall()
+            if use_arrow:
+                tbl = cur.fetchall_arrow()
+            else:
+                cols = [c[0] for c in cur.description] if cur.description else []
+                rows = cur.fetchall()
 
+    if tbl is not None:
         if as_df:
-            import pandas as pd
-            return pd.DataFrame(rows, columns=cols)
+            return tbl.to_pandas(self_destruct=True, split_blocks=True)
+        if as_records:
+            return tbl.to_pylist()
+        cols = tbl.column_names
+        data = tbl.to_pydict()
+        return {"columns": cols, "rows": [list(r) for r in zip(*(data[c] for c in cols))]}
+
+    if not as_records:
+        return {"columns": cols, "rows": [list(r) for r in rows]}
+
+    # lista de dicts
+    return [dict(zip(cols, r)) for r in rows] if cols else rows
+
+
+def _limiter() -> "anyio.CapacityLimiter":
+    # criado sob demanda: o CapacityLimiter precisa de um event loop ativo
+    global _LIMITER
+    if _LIMITER is None:
+        _LIMITER = anyio.CapacityLimiter(_THREAD_LIMIT)
+    return _LIMITER
+
+
+async def querydb_async(
+    sql_text: str,
+    params=None,
+    as_df: bool = False,
+    as_records: bool = True,
+    as_arrow: bool = False,
+):
+    """
+    Versão async do querydb: executa a chamada bloqueante numa thread do limiter dedicado.
+    """
+    return await anyio.to_thread.run_sync(
+        functools.partial(querydb, sql_text, params, as_df, as_records, as_arrow),
+        limiter=_limiter(),
+    )
+
+
+def _pop_total(items) -> int:
+    """
+    Extrai o total da coluna _total (COUNT(*) OVER ()) e remove a coluna das linhas.
+
+    Aceita tanto a lista de dicts quanto o formato colunar do querydb.
+    """
+    if isinstance(items, dict):
+        cols, rows = items["columns"], items["rows"]
+        if "_total" not in cols:
+            return 0
+        idx = cols.index("_total")
+        total = int(rows[0][idx]) if rows else 0
+        del cols[idx]
+        for r in rows:
+            del r[idx]
+        return total
+
+    total = int(items[0]["_total"]) if items else 0
+    for r in items:
+        r.pop("_total", None)
+    return total
+
+
+# Chaves do keyset: price_ts sozinho empata (vários postos/produtos no mesmo instante), então
+# a ordenação e o cursor levam colunas de desempate. Um fuel_type cobre vários produtos
+# (S10/S500, comum/aditivada), por isso o produto também entra na chave.
+# - gold_latest: uma linha por posto/produto, então (price_ts, cnpj, fuel_type, product_desc) é única.
+# - silver (por cnpj): (price_ts, fuel_type, product_desc) só é única com dados deduplicados; a
+#   mesma leitura recoletada em runs diferentes repete a chave e o `<` estrito pula as cópias.
+#   A paginação por cursor da série do posto pressupõe o silver deduplicado.
+_KEYSET_LATEST = ("price_ts", "cnpj", "fuel_type", "product_desc")
+_KEYSET_STATION = ("price_ts", "fuel_type", "product_desc")
+
+
+@functools.lru_cache(maxsize=None)
+def _keyset_order_sql(cols: tuple, dir_sql: str) -> str:
+    return ", ".join(f"{c} {dir_sql}" for c in cols)
+
+
+@functools.lru_cache(maxsize=None)
+def _keyset_where_sql(cols: tuple, dir_sql: str) -> str:
+    """
+    (c1, c2, ...) < (?, ?, ...) na forma expandida:
+    c1 < ? OR (c1 = ? AND (c2 < ? OR (c2 = ? AND ...))). Os parâmetros vêm de _keyset_params.
+    """
+    op = "<" if dir_sql == "DESC" else ">"
+    ph = ["TIMESTAMP(?)" if c == "price_ts" else "?" for c in cols]
+    expr = f"{cols[-1]} {op} {ph[-1]}"
+    for c, p in zip(reversed(cols[:-1]), reversed(ph[:-1])):
+        expr = f"{c} {op} {p} OR ({c} = {p} AND ({expr}))"
+    return f"({expr})"
+
+
+def _keyset_params(values: list) -> list:
+    # cada coluna, exceto a última, aparece duas vezes na forma expandida (< e =)
+    out = []
+    for v in values[:-1]:
+        out += [v, v]
+    out.append(values[-1])
+    return out
+
+
+def _parse_cursor(cursor: str, cols: tuple) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(cols):
+            raise ValueError
+        # só escalares chegam ao driver como parâmetro (bool é int em Python: recusado à parte)
+        if any(isinstance(v, bool) or not isinstance(v, (str, int)) for v in values):
+            raise ValueError
+        datetime.fromisoformat(values[cols.index("price_ts")])
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("cursor inválido. Use o next_cursor da página anterior") from None
+    return values
+
+
+def _encode_cursor(values: list) -> str:
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode("ascii")
+
+
+def _keyset_page(items, page_size: int, cols: tuple) -> dict:
+    """
+    has_more/next_cursor da paginação por keyset, a partir das colunas-chave da última linha.
+    """
+    if isinstance(items, dict):
+        rows = items["rows"]
+        n = len(rows)
+        idx = [items["columns"].index(c) for c in cols]
+        last = [rows[-1][i] for i in idx] if rows else None
+    else:
+        n = len(items)
+        last = [items[-1][c] for c in cols] if items else None
+
+    has_more = n == page_size
+    next_cursor = _encode_cursor(last) if has_more and last is not None else None
+    return {"has_more": has_more, "next_cursor": next_cursor}
+
+
+# --------------------------------------------------------------------------------------
+# Validação de ORDER BY (whitelist: identificadores entram na SQL via f-string)
+# --------------------------------------------------------------------------------------
+_ALLOWED_ORDER_BY_LATEST = frozenset({
+    "price_unit", "price_net", "price_gross", "discount", "price_ts",
+    "city", "uf", "station_name", "distance_km",
+})
+_ALLOWED_ORDER_BY_NEARBY = frozenset({"price_unit", "distance_km", "price_ts"})
+_ORDER_DIR = {"asc": "ASC", "ASC": "ASC", "desc": "DESC", "DESC": "DESC"}
+
+
+def _order_dir_sql(order_dir: str) -> str:
+    dir_sql = _ORDER_DIR.get(order_dir)
+    if dir_sql is None:
+        # caminho raro (" Desc", "Asc"...): normaliza só quando a busca direta falha
+        dir_sql = _ORDER_DIR.get(order_dir.lower().strip())
+    if dir_sql is None:
+        raise ValueError("order_dir inválido. Use: asc ou desc")
+    return dir_sql
+
+
+# --------------------------------------------------------------------------------------
+# In-process TTL cache
+# --------------------------------------------------------------------------------------
+def ttl_cached(ttl: float, key, maxsize: int = 1024):
+    """
+    Memoiza uma função async por `ttl` segundos, com chave calculada por `key(*args, **kwargs)`.
+
+    Chamadas concorrentes com a mesma chave esperam a primeira (dogpile) em vez de
+    dispararem várias queries iguais no warehouse.
+    """
+    def decorator(fn):
+        cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        locks: dict = {}
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            k = key(*args, **kwargs)
+            try:
+                return cache[k]
+            except KeyError:
+                pass
+
+            lock = locks.setdefault(k, asyncio.Lock())
+            try:
+                async with lock:
+                    try:
+                        return cache[k]
+                    except KeyError:
+                        pass
+                    value = await fn(*args, **kwargs)
+                    cache[k] = value
+                    return value
+            finally:
+                locks.pop(k, None)
+
+        wrapper.cache = cache
+        return wrapper
 
-        # lista de dicts
-        return [dict(zip(cols, r)) for r in rows] if cols else rows
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    return decorator
+
+
+# total do /prices/latest por fuel_type: só a primeira página paga o COUNT
+_LATEST_TOTAL_CACHE = TTLCache(maxsize=256, ttl=30)
+
+
+# --------------------------------------------------------------------------------------
+# SQL templates
+# --------------------------------------------------------------------------------------
+# Catálogo/tabelas vêm do ambiente e não mudam em runtime: cada SQL é montada uma única vez
+# por formato de filtro (where_sql só combina fragmentos fixos) e reaproveitada via lru_cache.
+@functools.lru_cache(maxsize=None)
+def _q_latest(where_sql: str, order_by: str, dir_sql: str, with_total: bool, keyset: bool = False) -> str:
+    cfg = _db_cfg()
+    total_sql = ",\n            COUNT(*) OVER () AS _total" if with_total else ""
+    limit_sql = "LIMIT ?" if keyset else "LIMIT ? OFFSET ?"
+    # por price_ts a ordem precisa ser total para o next_cursor não pular empates
+    if order_by == "price_ts":
+        order_sql = _keyset_order_sql(_KEYSET_LATEST, dir_sql)
+    else:
+        order_sql = f"{order_by} {dir_sql}"
+    return f"""
+        SELECT
+            fuel_type, uf, city, station_name, cnpj,
+            product_desc, unit,
+            price_ts, price_unit, price_net, price_gross, discount,
+            lat, lng, distance_km{total_sql}
+        FROM {cfg.catalog}.{cfg.gold_table}
+        {where_sql}
+        ORDER BY {order_sql}
+        {limit_sql}
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_daily_series(where_sql: str) -> str:
+    cfg = _db_cfg()
+    # o total é o número de dias agregados, por isso a janela fica no SELECT externo
+    return f"""
+        SELECT t.*, COUNT(*) OVER () AS _total
+        FROM (
+            SELECT
+                date_trunc('day', price_ts) AS day,
+                AVG(price_unit) AS avg_price_unit,
+                MIN(price_unit) AS min_price_unit,
+                MAX(price_unit) AS max_price_unit,
+                COUNT(*) AS samples
+            FROM {cfg.catalog}.{cfg.silver_table}
+            {where_sql}
+            GROUP BY date_trunc('day', price_ts)
+        ) t
+        ORDER BY day ASC
+        LIMIT ? OFFSET ?
+    """
+
+
+_STATION_COLS = (
+    "station_name", "city", "uf", "district", "street", "number", "zip_code", "lat", "lng",
+)
+_STATION_FUEL_COLS = (
+    "fuel_type", "product_desc", "unit",
+    "price_ts", "price_unit", "price_net", "price_gross", "discount",
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _q_station_detail() -> str:
+    cfg = _db_cfg()
+    station_sql = ",\n            ".join(f"ANY_VALUE({c}) AS {c}" for c in _STATION_COLS)
+    fuel_struct = ", ".join(f"'{c}', {c}" for c in _STATION_FUEL_COLS)
+    return f"""
+        SELECT
+            cnpj,
+            {station_sql},
+            array_sort(
+                COLLECT_LIST(named_struct({fuel_struct})),
+                (l, r) -> CASE WHEN l.price_ts > r.price_ts THEN -1
+                               WHEN l.price_ts < r.price_ts THEN 1
+                               ELSE 0 END
+            ) AS fuels
+        -- gold_latest já tem uma linha por posto/produto (S10/S500, comum/aditivada...):
+        -- não há histórico a cortar, e filtrar por fuel_type descartaria produtos
+        FROM {cfg.catalog}.{cfg.gold_table}
+        WHERE cnpj = ?
+        GROUP BY cnpj
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_station_series(where_sql: str, keyset: bool = False) -> str:
+    cfg = _db_cfg()
+    order_sql = _keyset_order_sql(_KEYSET_STATION, "DESC")
+    # keyset: sem COUNT e sem OFFSET, o cursor (_KEYSET_STATION) já posiciona a página
+    if keyset:
+        return f"""
+        SELECT
+            price_ts, fuel_type, product_desc, price_unit, price_net, price_gross, discount,
+            station_name, city, uf, lat, lng
+        FROM {cfg.catalog}.{cfg.silver_table}
+        {where_sql}
+        ORDER BY {order_sql}
+        LIMIT ?
+    """
+    return f"""
+        SELECT
+            price_ts, fuel_type, product_desc, price_unit, price_net, price_gross, discount,
+            station_name, city, uf, lat, lng,
+            COUNT(*) OVER () AS _total
+        FROM {cfg.catalog}.{cfg.silver_table}
+        {where_sql}
+        ORDER BY {order_sql}
+        LIMIT ? OFFSET ?
+    """
+
+
+# Haversine in km
+_DISTANCE_EXPR = """
+        (6371 * 2 * ASIN(
+            SQRT(
+                POW(SIN(RADIANS(lat - ?) / 2), 2) +
+                COS(RADIANS(?)) * COS(RADIANS(lat)) *
+                POW(SIN(RADIANS(lng - ?) / 2), 2)
+            )
+        ))
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_nearby(where_sql: str, order_by: str, dir_sql: str) -> str:
+    cfg = _db_cfg()
+    return f"""
+        SELECT
+            fuel_type, uf, city, station_name, cnpj,
+            product_desc, unit,
+            price_ts, price_unit, price_net, price_gross, discount,
+            lat, lng,
+            {_DISTANCE_EXPR} AS distance_km
+        FROM {cfg.catalog}.{cfg.gold_table}
+        {where_sql}
+        QUALIFY distance_km <= ?
+        ORDER BY {order_by} {dir_sql}
+        LIMIT ?
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_compare(where_sql: str) -> str:
+    cfg = _db_cfg()
+    return f"""
+        SELECT
+            fuel_type,
+            COALESCE(uf, '') AS uf,
+            COALESCE(city, '') AS city,
+            AVG(price_unit) AS avg_price_unit,
+            MIN(price_unit) AS min_price_unit,
+            MAX(price_unit) AS max_price_unit,
+            COUNT(*) AS stations,
+            MAX(price_ts) AS last_price_ts
+        FROM {cfg.catalog}.{cfg.gold_table}
+        {where_sql}
+        GROUP BY fuel_type, COALESCE(uf, ''), COALESCE(city, '')
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_stats_summary(where_sql: str) -> str:
+    cfg = _db_cfg()
+    return f"""
+        SELECT
+            COUNT(*) AS rows,
+            COUNT(DISTINCT cnpj) AS stations,
+            COUNT(DISTINCT city) AS cities,
+            COUNT(DISTINCT uf) AS ufs,
+            MIN(price_ts) AS min_price_ts,
+            MAX(price_ts) AS max_price_ts,
+            AVG(price_unit) AS avg_price_unit
+        FROM {cfg.catalog}.{cfg.silver_table}
+        {where_sql}
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_price_drop(where_sql: str) -> str:
+    cfg = _db_cfg()
+    return f"""
+        WITH base AS (
+          SELECT
+            cnpj,
+            station_name,
+            city,
+            uf,
+            price_ts,
+            price_unit
+          FROM {cfg.catalog}.{cfg.silver_table}
+          {where_sql}
+        ),
+        last_window AS (
+          SELECT
+            cnpj,
+            AVG(price_unit) AS avg_last
+          FROM base
+          WHERE price_ts >= current_timestamp() - make_interval(0, 0, 0, 0, ?, 0, 0)
+          GROUP BY cnpj
+        ),
+        prev_window AS (
+          SELECT
+            cnpj,
+            AVG(price_unit) AS avg_prev
+          FROM base
+          WHERE price_ts <  current_timestamp() - make_interval(0, 0, 0, 0, ?, 0, 0)
+            AND price_ts >= current_timestamp() - make_interval(0, 0, 0, 0, ?, 0, 0)
+          GROUP BY cnpj
+        )
+        SELECT
+          b.cnpj,
+          MAX(b.station_name) AS station_name,
+          MAX(b.city) AS city,
+          MAX(b.uf) AS uf,
+          l.avg_last,
+          p.avg_prev,
+          ((p.avg_prev - l.avg_last) / p.avg_prev) * 100 AS pct_drop
+        FROM base b
+        JOIN last_window l ON b.cnpj = l.cnpj
+        JOIN prev_window p ON b.cnpj = p.cnpj
+        GROUP BY b.cnpj, l.avg_last, p.avg_prev
+        HAVING p.avg_prev IS NOT NULL AND l.avg_last IS NOT NULL
+           AND ((p.avg_prev - l.avg_last) / p.avg_prev) * 100 >= ?
+        ORDER BY pct_drop DESC
+        LIMIT ?
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _q_anomalies(where_sql: str) -> str:
+    cfg = _db_cfg()
+    return f"""
+        WITH recent AS (
+          SELECT *
+          FROM {cfg.catalog}.{cfg.silver_table}
+          {where_sql}
+          AND price_ts >= current_timestamp() - make_interval(0, 0, 0, 0, ?, 0, 0)
+          AND price_unit IS NOT NULL
+        ),
+        stats AS (
+          SELECT
+            AVG(price_unit) AS mu,
+            STDDEV_SAMP(price_unit) AS sigma
+          FROM recent
+        )
+        SELECT
+          r.price_ts, r.cnpj, r.station_name, r.city, r.uf,
+          r.fuel_type, r.price_unit,
+          s.mu, s.sigma,
+          CASE WHEN s.sigma = 0 OR s.sigma IS NULL THEN NULL
+               ELSE (r.price_unit - s.mu) / s.sigma
+          END AS zscore
+        FROM recent r
+        CROSS JOIN stats s
+        WHERE s.sigma IS NOT NULL AND s.sigma > 0
+          AND ABS((r.price_unit - s.mu) / s.sigma) >= ?
+        ORDER BY ABS((r.price_unit - s.mu) / s.sigma) DESC
+        LIMIT ?
+    """
 
 
 # --------------------------------------------------------------------------------------
 # EXISTING APIs (você já tinha)
 # --------------------------------------------------------------------------------------
-def get_latest_prices(
+async def get_latest_prices(
     fuel_type: str | None,
     page: int,
     page_size: int,
     order_by: str,
     order_dir: str,
+    columnar: bool = False,
+    cursor: str | None = None,
 ):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+    if order_by not in _ALLOWED_ORDER_BY_LATEST:
+        raise ValueError(f"order_by inválido. Use um destes: {sorted(_ALLOWED_ORDER_BY_LATEST)}")
 
-    allowed_order_by = {
-        "price_unit", "price_net", "price_gross", "discount", "price_ts",
-        "city", "uf", "station_name", "distance_km"
-    }
-    if order_by not in allowed_order_by:
-        raise ValueError(f"order_by inválido. Use um destes: {sorted(allowed_order_by)}")
+    dir_sql = _order_dir_sql(order_dir)
 
-    order_dir = order_dir.lower().strip()
-    if order_dir not in {"asc", "desc"}:
-        raise ValueError("order_dir inválido. Use: asc ou desc")
+    if cursor is not None and order_by != "price_ts":
+        raise ValueError("cursor só é suportado com order_by=price_ts")
 
     where = []
     params = []
@@ -90,36 +694,44 @@ def get_latest_prices(
         where.append("fuel_type = ?")
         params.append(fuel_type)
 
+    if cursor is not None:
+        where.append(_keyset_where_sql(_KEYSET_LATEST, dir_sql))
+        params.extend(_keyset_params(_parse_cursor(cursor, _KEYSET_LATEST)))
+
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
-    offset = (page - 1) * page_size
 
-    q_total = f"SELECT COUNT(*) AS total FROM {table}{where_sql}"
-    total_rows = querydb(q_total, params=params, as_df=False)
-    total = int(total_rows[0]["total"]) if total_rows else 0
+    if cursor is not None:
+        q_data = _q_latest(where_sql, order_by, dir_sql, False, keyset=True)
+        items = await querydb_async(
+            q_data, params=list(params) + [page_size], as_df=False, as_records=not columnar
+        )
+        return {"page_size": page_size, **_keyset_page(items, page_size, _KEYSET_LATEST), "items": items}
 
-    q_data = f"""
-        SELECT
-            fuel_type, uf, city, station_name, cnpj,
-            product_desc, unit,
-            price_ts, price_unit, price_net, price_gross, discount,
-            lat, lng, distance_km
-        FROM {table}
-        {where_sql}
-        ORDER BY {order_by} {order_dir}
-        LIMIT ? OFFSET ?
-    """
+    offset = (page - 1) * page_size
+
+    total = _LATEST_TOTAL_CACHE.get(fuel_type)
+    q_data = _q_latest(where_sql, order_by, dir_sql, total is None)
     data_params = list(params) + [page_size, offset]
-    items = querydb(q_data, params=data_params, as_df=False)
+    items = await querydb_async(q_data, params=data_params, as_df=False, as_records=not columnar)
 
-    return {
+    if total is None:
+        total = _pop_total(items)
+        # página vazia não traz _total: não cachear um 0 possivelmente falso
+        if total:
+            _LATEST_TOTAL_CACHE[fuel_type] = total
+
+    page_info = {
         "page": page,
         "page_size": page_size,
         "total": total,
         "items": items,
     }
+    if order_by == "price_ts":
+        page_info.update(_keyset_page(items, page_size, _KEYSET_LATEST))
+    return page_info
 
 
-def get_timeseries(
+async def get_timeseries(
     fuel_type: str | None,
     date_from: str | None,
     date_to: str | None,
@@ -130,9 +742,6 @@ def get_timeseries(
     Timeseries agregada por dia (média de price_unit).
     date_from/date_to em formato string: "YYYY-MM-DD HH:MM:SS"
     """
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
     where = []
     params = []
 
@@ -151,33 +760,10 @@ def get_timeseries(
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
     offset = (page - 1) * page_size
 
-    q_total = f"""
-        SELECT COUNT(*) AS total
-        FROM (
-            SELECT date_trunc('day', price_ts) AS day
-            FROM {table}
-            {where_sql}
-            GROUP BY date_trunc('day', price_ts)
-        ) t
-    """
-    total_rows = querydb(q_total, params=params, as_df=False)
-    total = int(total_rows[0]["total"]) if total_rows else 0
-
-    q_data = f"""
-        SELECT
-            date_trunc('day', price_ts) AS day,
-            AVG(price_unit) AS avg_price_unit,
-            MIN(price_unit) AS min_price_unit,
-            MAX(price_unit) AS max_price_unit,
-            COUNT(*) AS samples
-        FROM {table}
-        {where_sql}
-        GROUP BY date_trunc('day', price_ts)
-        ORDER BY day ASC
-        LIMIT ? OFFSET ?
-    """
+    q_data = _q_daily_series(where_sql)
     data_params = list(params) + [page_size, offset]
-    items = querydb(q_data, params=data_params, as_df=False)
+    items = await querydb_async(q_data, params=data_params, as_df=False)
+    total = _pop_total(items)
 
     return {
         "page": page,
@@ -190,57 +776,60 @@ def get_timeseries(
 # --------------------------------------------------------------------------------------
 # NEW APIs helpers
 # --------------------------------------------------------------------------------------
-def ping_db():
-    rows = querydb("SELECT 1 AS ok", params=(), as_df=False)
+async def ping_db():
+    rows = await querydb_async("SELECT 1 AS ok", params=(), as_df=False)
     return {"ok": True, "db": rows[0] if rows else {"ok": 1}}
 
 
-def get_fuel_types():
+@ttl_cached(ttl=60, key=lambda: ("fuel_types",))
+async def get_fuel_types():
     cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+    table = f"{cfg.catalog}.{cfg.gold_table}"
     q = f"""
         SELECT DISTINCT fuel_type
         FROM {table}
         WHERE fuel_type IS NOT NULL
         ORDER BY fuel_type
     """
-    rows = querydb(q, params=(), as_df=False)
+    rows = await querydb_async(q, params=(), as_df=False)
     return [r["fuel_type"] for r in rows]
 
 
-def get_cities(uf: str | None = None, limit: int = 500):
+@ttl_cached(ttl=60, key=lambda uf=None, limit=500: ("cities", uf, limit))
+async def get_cities(uf: str | None = None, limit: int = 500):
     cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+    table = f"{cfg.catalog}.{cfg.gold_table}"
 
-    where = []
+    where = ["city IS NOT NULL"]
     params = []
     if uf:
         where.append("uf = ?")
         params.append(uf)
 
-    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    where_sql = " WHERE " + " AND ".join(where)
     q = f"""
         SELECT DISTINCT uf, city
         FROM {table}
         {where_sql}
-        AND city IS NOT NULL
         ORDER BY uf, city
         LIMIT ?
     """
     params.append(limit)
-    return querydb(q, params=params, as_df=False)
+    return await querydb_async(q, params=params, as_df=False)
 
 
-def search_stations(q: str | None, uf: str | None, city: str | None, limit: int = 50):
+async def search_stations(q: str | None, uf: str | None, city: str | None, limit: int = 50):
     cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+    table = f"{cfg.catalog}.{cfg.gold_table}"
 
     where = []
     params = []
 
     if q:
-        where.append("LOWER(station_name) LIKE ?")
-        params.append(f"%{q.lower()}%")
+        # ILIKE não aplica função na coluna, então o data skipping em station_name continua valendo.
+        # Com curinga explícito (ex.: "posto%") o padrão vai como está; prefixo fixo permite poda por faixa.
+        where.append("station_name ILIKE ?")
+        params.append(q if "%" in q else f"%{q}%")
     if uf:
         where.append("uf = ?")
         params.append(uf)
@@ -258,56 +847,17 @@ def search_stations(q: str | None, uf: str | None, city: str | None, limit: int
         LIMIT ?
     """
     params.append(limit)
-    return querydb(qsql, params=params, as_df=False)
+    return await querydb_async(qsql, params=params, as_df=False)
 
 
-def get_station_detail(cnpj: int):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+async def get_station_detail(cnpj: int):
+    # uma linha por posto: o reshape (cabeçalho + lista de combustíveis) é feito no SQL.
+    # Arrow devolve o array de structs já como lista de dicts.
+    rows = await querydb_async(_q_station_detail(), params=(cnpj,), as_df=False, as_arrow=True)
+    return rows[0] if rows else None
 
-    qsql = f"""
-        SELECT
-            cnpj, station_name, city, uf, district, street, number, zip_code, lat, lng,
-            fuel_type, product_desc, unit,
-            price_ts, price_unit, price_net, price_gross, discount
-        FROM {table}
-        WHERE cnpj = ?
-        ORDER BY price_ts DESC
-    """
-    rows = querydb(qsql, params=(cnpj,), as_df=False)
-    if not rows:
-        return None
-
-    base = rows[0].copy()
-    fuels = []
-    for r in rows:
-        fuels.append({
-            "fuel_type": r.get("fuel_type"),
-            "product_desc": r.get("product_desc"),
-            "unit": r.get("unit"),
-            "price_ts": r.get("price_ts"),
-            "price_unit": r.get("price_unit"),
-            "price_net": r.get("price_net"),
-            "price_gross": r.get("price_gross"),
-            "discount": r.get("discount"),
-        })
-
-    return {
-        "cnpj": base.get("cnpj"),
-        "station_name": base.get("station_name"),
-        "city": base.get("city"),
-        "uf": base.get("uf"),
-        "district": base.get("district"),
-        "street": base.get("street"),
-        "number": base.get("number"),
-        "zip_code": base.get("zip_code"),
-        "lat": base.get("lat"),
-        "lng": base.get("lng"),
-        "fuels": fuels,
-    }
 
-
-def get_prices_nearby(
+async def get_prices_nearby(
     lat: float,
     lng: float,
     radius_km: float,
@@ -320,32 +870,15 @@ def get_prices_nearby(
     Nearby prices with computed distance using Haversine.
     Works even if your table doesn't have distance_km.
     """
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
-
-    allowed_order_by = {"price_unit", "distance_km", "price_ts"}
-    if order_by not in allowed_order_by:
-        raise ValueError(f"order_by inválido. Use: {sorted(allowed_order_by)}")
+    if order_by not in _ALLOWED_ORDER_BY_NEARBY:
+        raise ValueError(f"order_by inválido. Use: {sorted(_ALLOWED_ORDER_BY_NEARBY)}")
 
-    order_dir = order_dir.lower().strip()
-    if order_dir not in {"asc", "desc"}:
-        raise ValueError("order_dir inválido. Use: asc ou desc")
+    dir_sql = _order_dir_sql(order_dir)
 
     where = ["lat IS NOT NULL", "lng IS NOT NULL"]
     params = []
 
-    # Haversine in km
-    distance_expr = """
-        (6371 * 2 * ASIN(
-            SQRT(
-                POW(SIN(RADIANS(lat - ?) / 2), 2) +
-                COS(RADIANS(?)) * COS(RADIANS(lat)) *
-                POW(SIN(RADIANS(lng - ?) / 2), 2)
-            )
-        ))
-    """
-
-    # parameters for distance_expr: lat, lat, lng
+    # parameters for _DISTANCE_EXPR: lat, lat, lng
     params.extend([lat, lat, lng])
 
     if fuel_type:
@@ -354,28 +887,24 @@ def get_prices_nearby(
 
     where_sql = " WHERE " + " AND ".join(where)
 
-    qsql = f"""
-        SELECT
-            fuel_type, uf, city, station_name, cnpj,
-            product_desc, unit,
-            price_ts, price_unit, price_net, price_gross, discount,
-            lat, lng,
-            {distance_expr} AS distance_km
-        FROM {table}
-        {where_sql}
-        QUALIFY distance_km <= ?
-        ORDER BY {order_by} {order_dir}
-        LIMIT ?
-    """
+    qsql = _q_nearby(where_sql, order_by, dir_sql)
     params.append(radius_km)
     params.append(limit)
 
-    return {"items": querydb(qsql, params=params, as_df=False)}
+    return {"items": await querydb_async(qsql, params=params, as_df=False, as_arrow=True)}
+
+
+async def _is_known_fuel(fuel_type: str) -> bool:
+    # get_fuel_types() está no TTL cache: rejeita combustível inexistente sem ir ao warehouse
+    return fuel_type in set(await get_fuel_types())
+
 
+async def get_best_prices(fuel_type: str, uf: str | None, city: str | None, limit: int):
+    if not await _is_known_fuel(fuel_type):
+        return []
 
-def get_best_prices(fuel_type: str, uf: str | None, city: str | None, limit: int):
     cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+    table = f"{cfg.catalog}.{cfg.gold_table}"
 
     where = ["fuel_type = ?"]
     params = [fuel_type]
@@ -400,12 +929,13 @@ def get_best_prices(fuel_type: str, uf: str | None, city: str | None, limit: int
         LIMIT ?
     """
     params.append(limit)
-    return querydb(qsql, params=params, as_df=False)
+    return await querydb_async(qsql, params=params, as_df=False)
 
 
-def get_prices_compare(fuel_type: str, uf: str | None, city: str | None):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['gold_table']}"
+@ttl_cached(ttl=60, key=lambda fuel_type, uf, city: ("compare", fuel_type, uf, city))
+async def get_prices_compare(fuel_type: str, uf: str | None, city: str | None):
+    if not await _is_known_fuel(fuel_type):
+        return {"fuel_type": fuel_type, "stations": 0}
 
     where = ["fuel_type = ?"]
     params = [fuel_type]
@@ -419,28 +949,15 @@ def get_prices_compare(fuel_type: str, uf: str | None, city: str | None):
 
     where_sql = " WHERE " + " AND ".join(where)
 
-    qsql = f"""
-        SELECT
-            fuel_type,
-            COALESCE(uf, '') AS uf,
-            COALESCE(city, '') AS city,
-            AVG(price_unit) AS avg_price_unit,
-            MIN(price_unit) AS min_price_unit,
-            MAX(price_unit) AS max_price_unit,
-            COUNT(*) AS stations,
-            MAX(price_ts) AS last_price_ts
-        FROM {table}
-        {where_sql}
-        GROUP BY fuel_type, COALESCE(uf, ''), COALESCE(city, '')
-    """
-    rows = querydb(qsql, params=params, as_df=False)
+    rows = await querydb_async(_q_compare(where_sql), params=params, as_df=False)
     return rows[0] if rows else {"fuel_type": fuel_type, "stations": 0}
 
 
-def get_stats_summary(date_from: str | None, date_to: str | None, uf: str | None, city: str | None, fuel_type: str | None):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
+@ttl_cached(
+    ttl=60,
+    key=lambda date_from, date_to, uf, city, fuel_type: ("stats_summary", date_from, date_to, uf, city, fuel_type),
+)
+async def get_stats_summary(date_from: str | None, date_to: str | None, uf: str | None, city: str | None, fuel_type: str | None):
     where = []
     params = []
 
@@ -462,23 +979,11 @@ def get_stats_summary(date_from: str | None, date_to: str | None, uf: str | None
 
     where_sql = (" WHERE " + " AND ".join(where)) if where else ""
 
-    qsql = f"""
-        SELECT
-            COUNT(*) AS rows,
-            COUNT(DISTINCT cnpj) AS stations,
-            COUNT(DISTINCT city) AS cities,
-            COUNT(DISTINCT uf) AS ufs,
-            MIN(price_ts) AS min_price_ts,
-            MAX(price_ts) AS max_price_ts,
-            AVG(price_unit) AS avg_price_unit
-        FROM {table}
-        {where_sql}
-    """
-    rows = querydb(qsql, params=params, as_df=False)
+    rows = await querydb_async(_q_stats_summary(where_sql), params=params, as_df=False)
     return rows[0] if rows else {}
 
 
-def get_timeseries_city(
+async def get_timeseries_city(
     fuel_type: str,
     uf: str | None,
     city: str | None,
@@ -487,9 +992,6 @@ def get_timeseries_city(
     page: int,
     page_size: int,
 ):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
     where = ["fuel_type = ?"]
     params = [fuel_type]
 
@@ -509,48 +1011,28 @@ def get_timeseries_city(
     where_sql = " WHERE " + " AND ".join(where)
     offset = (page - 1) * page_size
 
-    q_total = f"""
-        SELECT COUNT(*) AS total
-        FROM (
-            SELECT date_trunc('day', price_ts) AS day
-            FROM {table}
-            {where_sql}
-            GROUP BY date_trunc('day', price_ts)
-        ) t
-    """
-    total_rows = querydb(q_total, params=params, as_df=False)
-    total = int(total_rows[0]["total"]) if total_rows else 0
-
-    q_data = f"""
-        SELECT
-            date_trunc('day', price_ts) AS day,
-            AVG(price_unit) AS avg_price_unit,
-            MIN(price_unit) AS min_price_unit,
-            MAX(price_unit) AS max_price_unit,
-            COUNT(*) AS samples
-        FROM {table}
-        {where_sql}
-        GROUP BY date_trunc('day', price_ts)
-        ORDER BY day ASC
-        LIMIT ? OFFSET ?
-    """
+    q_data = _q_daily_series(where_sql)
     data_params = list(params) + [page_size, offset]
-    items = querydb(q_data, params=data_params, as_df=False)
+    items = await querydb_async(q_data, params=data_params, as_df=False)
+    total = _pop_total(items)
 
     return {"page": page, "page_size": page_size, "total": total, "items": items}
 
 
-def get_timeseries_station(
+async def get_timeseries_station(
     cnpj: int,
     fuel_type: str | None,
     date_from: str | None,
     date_to: str | None,
     page: int,
     page_size: int,
+    columnar: bool = False,
+    cursor: str | None = None,
 ):
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
+    """
+    Série de preços de um posto (silver). O cursor pressupõe o silver deduplicado:
+    leituras repetidas entre runs empatam na chave do keyset (ver _KEYSET_STATION).
+    """
     where = ["cnpj = ?"]
     params = [cnpj]
 
@@ -563,30 +1045,35 @@ def get_timeseries_station(
     if date_to:
         where.append("price_ts <= TIMESTAMP(?)")
         params.append(date_to)
+    if cursor is not None:
+        where.append(_keyset_where_sql(_KEYSET_STATION, "DESC"))
+        params.extend(_keyset_params(_parse_cursor(cursor, _KEYSET_STATION)))
 
     where_sql = " WHERE " + " AND ".join(where)
-    offset = (page - 1) * page_size
 
-    q_total = f"SELECT COUNT(*) AS total FROM {table}{where_sql}"
-    total_rows = querydb(q_total, params=params, as_df=False)
-    total = int(total_rows[0]["total"]) if total_rows else 0
+    if cursor is not None:
+        data_params = list(params) + [page_size]
+    else:
+        data_params = list(params) + [page_size, (page - 1) * page_size]
+
+    # páginas de até 2000 linhas: Arrow evita o loop de desserialização por linha
+    items = await querydb_async(
+        _q_station_series(where_sql, keyset=cursor is not None),
+        params=data_params,
+        as_df=False,
+        as_records=not columnar,
+        as_arrow=True,
+    )
+    keyset = _keyset_page(items, page_size, _KEYSET_STATION)
 
-    q_data = f"""
-        SELECT
-            price_ts, fuel_type, price_unit, price_net, price_gross, discount,
-            station_name, city, uf, lat, lng
-        FROM {table}
-        {where_sql}
-        ORDER BY price_ts DESC
-        LIMIT ? OFFSET ?
-    """
-    data_params = list(params) + [page_size, offset]
-    items = querydb(q_data, params=data_params, as_df=False)
+    if cursor is not None:
+        return {"page_size": page_size, **keyset, "items": items}
 
-    return {"page": page, "page_size": page_size, "total": total, "items": items}
+    total = _pop_total(items)
+    return {"page": page, "page_size": page_size, "total": total, **keyset, "items": items}
 
 
-def get_price_drop_alerts(
+async def get_price_drop_alerts(
     fuel_type: str,
     uf: str | None,
     city: str | None,
@@ -597,9 +1084,6 @@ def get_price_drop_alerts(
     """
     Queda percentual do preço médio do posto nas últimas N horas vs N horas anteriores.
     """
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
     where = ["fuel_type = ?"]
     params = [fuel_type]
 
@@ -612,57 +1096,12 @@ def get_price_drop_alerts(
 
     where_sql = " WHERE " + " AND ".join(where)
 
-    qsql = f"""
-        WITH base AS (
-          SELECT
-            cnpj,
-            station_name,
-            city,
-            uf,
-            price_ts,
-            price_unit
-          FROM {table}
-          {where_sql}
-        ),
-        last_window AS (
-          SELECT
-            cnpj,
-            AVG(price_unit) AS avg_last
-          FROM base
-          WHERE price_ts >= current_timestamp() - INTERVAL {hours} HOURS
-          GROUP BY cnpj
-        ),
-        prev_window AS (
-          SELECT
-            cnpj,
-            AVG(price_unit) AS avg_prev
-          FROM base
-          WHERE price_ts <  current_timestamp() - INTERVAL {hours} HOURS
-            AND price_ts >= current_timestamp() - INTERVAL {hours * 2} HOURS
-          GROUP BY cnpj
-        )
-        SELECT
-          b.cnpj,
-          MAX(b.station_name) AS station_name,
-          MAX(b.city) AS city,
-          MAX(b.uf) AS uf,
-          l.avg_last,
-          p.avg_prev,
-          ((p.avg_prev - l.avg_last) / p.avg_prev) * 100 AS pct_drop
-        FROM base b
-        JOIN last_window l ON b.cnpj = l.cnpj
-        JOIN prev_window p ON b.cnpj = p.cnpj
-        GROUP BY b.cnpj, l.avg_last, p.avg_prev
-        HAVING p.avg_prev IS NOT NULL AND l.avg_last IS NOT NULL
-           AND ((p.avg_prev - l.avg_last) / p.avg_prev) * 100 >= ?
-        ORDER BY pct_drop DESC
-        LIMIT ?
-    """
-    params2 = list(params) + [pct_drop, limit]
-    return querydb(qsql, params=params2, as_df=False)
+    # hours vai como parâmetro (não f-string) para o warehouse reaproveitar o plano
+    params2 = list(params) + [hours, hours, hours * 2, pct_drop, limit]
+    return await querydb_async(_q_price_drop(where_sql), params=params2, as_df=False)
 
 
-def get_anomalies(
+async def get_anomalies(
     fuel_type: str,
     uf: str | None,
     city: str | None,
@@ -673,9 +1112,6 @@ def get_anomalies(
     """
     Anomalias por z-score nas últimas N horas (escopo por filtro uf/city).
     """
-    cfg = _db_cfg()
-    table = f"{cfg['catalog']}.{cfg['silver_table']}"
-
     where = ["fuel_type = ?"]
     params = [fuel_type]
 
@@ -688,33 +1124,5 @@ def get_anomalies(
 
     where_sql = " WHERE " + " AND ".join(where)
 
-    qsql = f"""
-        WITH recent AS (
-          SELECT *
-          FROM {table}
-          {where_sql}
-          AND price_ts >= current_timestamp() - INTERVAL {hours} HOURS
-          AND price_unit IS NOT NULL
-        ),
-        stats AS (
-          SELECT
-            AVG(price_unit) AS mu,
-            STDDEV_SAMP(price_unit) AS sigma
-          FROM recent
-        )
-        SELECT
-          r.price_ts, r.cnpj, r.station_name, r.city, r.uf,
-          r.fuel_type, r.price_unit,
-          s.mu, s.sigma,
-          CASE WHEN s.sigma = 0 OR s.sigma IS NULL THEN NULL
-               ELSE (r.price_unit - s.mu) / s.sigma
-          END AS zscore
-        FROM recent r
-        CROSS JOIN stats s
-        WHERE s.sigma IS NOT NULL AND s.sigma > 0
-          AND ABS((r.price_unit - s.mu) / s.sigma) >= ?
-        ORDER BY ABS((r.price_unit - s.mu) / s.sigma) DESC
-        LIMIT ?
-    """
-    params2 = list(params) + [z, limit]
-    return querydb(qsql, params=params2, as_df=False)
+    params2 = list(params) + [hours, z, limit]
+    return await querydb_async(_q_anomalies(where_sql), params=params2, as_df=False)
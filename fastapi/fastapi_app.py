@@ -1,4 +1,10 @@
+import os
+from decimal import Decimal
+from typing import Literal
+
 from fastapi import FastAPI, Query, HTTPException
+from fastapi.responses import Response
+import orjson
 import uvicorn
 
 from dblib.querydb import (
@@ -22,29 +28,58 @@ from dblib.querydb import (
     get_anomalies,
 )
 
-app = FastAPI(title="Simple FastAPI with Databricks")
+
+class ORJSONResponse(Response):
+    """
+    JSON via orjson. Implementação própria: a fastapi.responses.ORJSONResponse está
+    marcada como deprecated nas versões recentes do FastAPI.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+app = FastAPI(title="Simple FastAPI with Databricks", default_response_class=ORJSONResponse)
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+class RawORJSONResponse(ORJSONResponse):
+    """
+    Resposta serializada direto pelo orjson, sem passar pelo jsonable_encoder do FastAPI.
+    Usada pelas rotas /v2 que devolvem o resultado do querydb como está (inclusive colunar).
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
 
 
 @app.get("/")
-def root():
+async def root():
     return {"message": "Hello Databricks"}
 
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 
 @app.get("/health/db")
-def health_db():
+async def health_db():
     try:
-        return ping_db()
+        return await ping_db()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/add/{num1}/{num2}")
-def add(num1: int, num2: int):
+async def add(num1: int, num2: int):
     return {"total": num1 + num2}
 
 
@@ -52,20 +87,20 @@ def add(num1: int, num2: int):
 # 1) META
 # -----------------------------
 @app.get("/meta/fuel-types")
-def meta_fuel_types():
+async def meta_fuel_types():
     try:
-        return {"items": get_fuel_types()}
+        return {"items": await get_fuel_types()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/meta/cities")
-def meta_cities(
+async def meta_cities(
     uf: str | None = Query(None, min_length=2, max_length=2),
     limit: int = Query(500, ge=1, le=5000),
 ):
     try:
-        return {"items": get_cities(uf=uf, limit=limit)}
+        return {"items": await get_cities(uf=uf, limit=limit)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -74,22 +109,22 @@ def meta_cities(
 # 2) STATIONS
 # -----------------------------
 @app.get("/stations/search")
-def stations_search(
-    q: str | None = Query(None, description="Busca por station_name (contém)"),
+async def stations_search(
+    q: str | None = Query(None, description="Busca por station_name (contém). Aceita curingas: posto% = começa com"),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
     limit: int = Query(50, ge=1, le=500),
 ):
     try:
-        return {"items": search_stations(q=q, uf=uf, city=city, limit=limit)}
+        return {"items": await search_stations(q=q, uf=uf, city=city, limit=limit)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/stations/{cnpj}")
-def station_detail(cnpj: int):
+async def station_detail(cnpj: int):
     try:
-        data = get_station_detail(cnpj)
+        data = await get_station_detail(cnpj)
         if not data:
             raise HTTPException(status_code=404, detail="Posto não encontrado")
         return data
@@ -103,15 +138,16 @@ def station_detail(cnpj: int):
 # 3) PRICES (LATEST, NEARBY, BEST, COMPARE)
 # -----------------------------
 @app.get("/prices/latest")
-def prices_latest_alias(
+async def prices_latest_alias(
     fuel_type: str | None = Query(None),
     page: int = Query(1, ge=1),
     page_size: int = Query(25, ge=1, le=200),
     order_by: str = Query("price_unit"),
     order_dir: str = Query("asc"),
+    cursor: str | None = Query(None, description="next_cursor da página anterior (só com order_by=price_ts)"),
 ):
     try:
-        return get_latest_prices(fuel_type, page, page_size, order_by, order_dir)
+        return await get_latest_prices(fuel_type, page, page_size, order_by, order_dir, cursor=cursor)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
@@ -119,15 +155,16 @@ def prices_latest_alias(
 
 
 @app.get("/latest")
-def latest(
+async def latest(
     fuel_type: str | None = Query(None),
     page: int = Query(1, ge=1),
     page_size: int = Query(25, ge=1, le=200),
     order_by: str = Query("price_unit"),
     order_dir: str = Query("asc"),
+    cursor: str | None = Query(None, description="next_cursor da página anterior (só com order_by=price_ts)"),
 ):
     try:
-        return get_latest_prices(fuel_type, page, page_size, order_by, order_dir)
+        return await get_latest_prices(fuel_type, page, page_size, order_by, order_dir, cursor=cursor)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
@@ -135,7 +172,7 @@ def latest(
 
 
 @app.get("/prices/nearby")
-def prices_nearby(
+async def prices_nearby(
     lat: float = Query(...),
     lng: float = Query(...),
     radius_km: float = Query(5.0, gt=0, le=200),
@@ -145,7 +182,7 @@ def prices_nearby(
     order_dir: str = Query("asc", description="asc | desc"),
 ):
     try:
-        return get_prices_nearby(lat, lng, radius_km, fuel_type, limit, order_by, order_dir)
+        return await get_prices_nearby(lat, lng, radius_km, fuel_type, limit, order_by, order_dir)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
@@ -153,26 +190,26 @@ def prices_nearby(
 
 
 @app.get("/prices/best")
-def prices_best(
+async def prices_best(
     fuel_type: str = Query(...),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
     limit: int = Query(20, ge=1, le=200),
 ):
     try:
-        return {"items": get_best_prices(fuel_type=fuel_type, uf=uf, city=city, limit=limit)}
+        return {"items": await get_best_prices(fuel_type=fuel_type, uf=uf, city=city, limit=limit)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/prices/compare")
-def prices_compare(
+async def prices_compare(
     fuel_type: str = Query(...),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
 ):
     try:
-        return get_prices_compare(fuel_type=fuel_type, uf=uf, city=city)
+        return await get_prices_compare(fuel_type=fuel_type, uf=uf, city=city)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -181,7 +218,7 @@ def prices_compare(
 # 4) TIMESERIES
 # -----------------------------
 @app.get("/timeseries")
-def timeseries(
+async def timeseries(
     fuel_type: str | None = Query(None),
     date_from: str | None = Query(None),  # "2026-01-10 00:00:00"
     date_to: str | None = Query(None),    # "2026-01-16 23:59:59"
@@ -189,7 +226,7 @@ def timeseries(
     page_size: int = Query(50, ge=1, le=200),
 ):
     try:
-        return get_timeseries(fuel_type, date_from, date_to, page, page_size)
+        return await get_timeseries(fuel_type, date_from, date_to, page, page_size)
     except ValueError as e:
         raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
@@ -197,7 +234,7 @@ def timeseries(
 
 
 @app.get("/timeseries/city")
-def timeseries_city(
+async def timeseries_city(
     fuel_type: str = Query(...),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
@@ -207,22 +244,25 @@ def timeseries_city(
     page_size: int = Query(50, ge=1, le=500),
 ):
     try:
-        return get_timeseries_city(fuel_type, uf, city, date_from, date_to, page, page_size)
+        return await get_timeseries_city(fuel_type, uf, city, date_from, date_to, page, page_size)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/timeseries/station")
-def timeseries_station(
+async def timeseries_station(
     cnpj: int = Query(...),
     fuel_type: str | None = Query(None),
     date_from: str | None = Query(None),
     date_to: str | None = Query(None),
     page: int = Query(1, ge=1),
     page_size: int = Query(100, ge=1, le=2000),
+    cursor: str | None = Query(None, description="next_cursor da página anterior (dispensa page e total)"),
 ):
     try:
-        return get_timeseries_station(cnpj, fuel_type, date_from, date_to, page, page_size)
+        return await get_timeseries_station(cnpj, fuel_type, date_from, date_to, page, page_size, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -231,7 +271,7 @@ def timeseries_station(
 # 5) STATS / ALERTS / ANOMALIES
 # -----------------------------
 @app.get("/stats/summary")
-def stats_summary(
+async def stats_summary(
     date_from: str | None = Query(None),
     date_to: str | None = Query(None),
     uf: str | None = Query(None, min_length=2, max_length=2),
@@ -239,13 +279,13 @@ def stats_summary(
     fuel_type: str | None = Query(None),
 ):
     try:
-        return get_stats_summary(date_from, date_to, uf, city, fuel_type)
+        return await get_stats_summary(date_from, date_to, uf, city, fuel_type)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/alerts/price-drop")
-def alerts_price_drop(
+async def alerts_price_drop(
     fuel_type: str = Query(...),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
@@ -254,13 +294,13 @@ def alerts_price_drop(
     limit: int = Query(50, ge=1, le=500),
 ):
     try:
-        return {"items": get_price_drop_alerts(fuel_type, uf, city, hours, pct_drop, limit)}
+        return {"items": await get_price_drop_alerts(fuel_type, uf, city, hours, pct_drop, limit)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/anomalies")
-def anomalies(
+async def anomalies(
     fuel_type: str = Query(...),
     uf: str | None = Query(None, min_length=2, max_length=2),
     city: str | None = Query(None),
@@ -269,10 +309,65 @@ def anomalies(
     limit: int = Query(100, ge=1, le=2000),
 ):
     try:
-        return {"items": get_anomalies(fuel_type, uf, city, hours, z, limit)}
+        return {"items": await get_anomalies(fuel_type, uf, city, hours, z, limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# 6) V2 (formato colunar opcional)
+# -----------------------------
+@app.get("/v2/prices/latest")
+async def v2_prices_latest(
+    fuel_type: str | None = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(25, ge=1, le=200),
+    order_by: str = Query("price_unit"),
+    order_dir: str = Query("asc"),
+    fmt: Literal["records", "columnar"] = Query("columnar", alias="format"),
+    cursor: str | None = Query(None, description="next_cursor da página anterior (só com order_by=price_ts)"),
+):
+    try:
+        data = await get_latest_prices(
+            fuel_type, page, page_size, order_by, order_dir, columnar=fmt == "columnar", cursor=cursor
+        )
+        return RawORJSONResponse(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/v2/timeseries/station")
+async def v2_timeseries_station(
+    cnpj: int = Query(...),
+    fuel_type: str | None = Query(None),
+    date_from: str | None = Query(None),
+    date_to: str | None = Query(None),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(100, ge=1, le=2000),
+    fmt: Literal["records", "columnar"] = Query("columnar", alias="format"),
+    cursor: str | None = Query(None, description="next_cursor da página anterior (dispensa page e total)"),
+):
+    try:
+        data = await get_timeseries_station(
+            cnpj, fuel_type, date_from, date_to, page, page_size, columnar=fmt == "columnar", cursor=cursor
+        )
+        return RawORJSONResponse(data)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
-    uvicorn.run("fastapi_app:app", host="0.0.0.0", port=8000, reload=True)
+    # Cada worker tem seu próprio pool de conexões: total no warehouse = workers x DATABRICKS_POOL_SIZE
+    uvicorn.run(
+        "fastapi_app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2)),
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+    )
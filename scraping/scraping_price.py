@@ -11,7 +11,7 @@ What this script does
 - Produces structured logs (console + file) to validate the run and troubleshoot issues
 
 Install
-  pip install requests
+  pip install requests orjson
 
 Run
   python scraping_price.py
@@ -25,7 +25,12 @@ Outputs
 
 Notes
 - This endpoint enforces request limits (HTTP 429).
-  The script implements exponential backoff + jitter and honors Retry-After when present.
+  Requests are paced by an adaptive token bucket (the rate grows on success and is cut
+  on 429) and Retry-After is honored when present; network/5xx errors use exponential
+  backoff + jitter.
+- Fuels are fetched concurrently (one thread each) over a single keep-alive session.
+- The CSRF token and session cookies are cached under OUT_DIR/.cache for 30 minutes,
+  so scheduled reruns skip the bootstrap until the server rejects the token (400/401/403).
 - For a production pipeline, you would:
   (1) schedule the extraction (e.g., every 10 minutes),
   (2) store raw data in a Bronze layer (Delta),
@@ -36,15 +41,24 @@ Notes
 import os
 import re
 import json
+import string
+import hashlib
 import uuid
 import time
 import random
+import atexit
 import logging
+import logging.handlers
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
-from urllib.parse import urljoin
-from typing import Dict, Any, Optional, List, Tuple
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, quote_plus
+from typing import Dict, Any, Optional, List, Tuple, Union, Iterable, Iterator
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 
 # -----------------------------
 # Configuration (case/demo)
@@ -63,19 +77,77 @@ ORDENAR = "preco.asc"
 
 MAX_PAGES_PER_FUEL = 1  # <-- requested: only 1 page per fuel
 
+# Form body of the POST: everything but `anp` is constant, so it is urlencoded once here
+_PAYLOAD_STATIC = (
+    f"horas={HORAS}&latitude={quote_plus(str(LATITUDE))}&longitude={quote_plus(str(LONGITUDE))}"
+    f"&raio={RAIO}&pagina=1&ordenar={quote_plus(ORDENAR)}"
+)
+
 # Rate-limit / retry behavior
 MAX_RETRIES = 6
 BASE_BACKOFF_SECONDS = 2.0
 MAX_BACKOFF_SECONDS = 60.0
 
-# Polite pacing between fuels (still helps avoid 429)
-SLEEP_BETWEEN_FUELS = (1.2, 2.4)
+# Adaptive token bucket (requests/second): grows on success, shrinks on 429
+ATB_INITIAL_RATE = 1.0
+ATB_MIN_RATE = 0.1
+ATB_MAX_RATE = 8.0
+ATB_CAPACITY = 4.0
+
+# Fuels are fetched concurrently over the same session; a small random start delay
+# per fuel avoids hitting the server with all POSTs at the exact same instant
+FUEL_CONCURRENCY = len(FUELS)
+FUEL_START_JITTER = (0.0, 0.5)
+
+# Connection pool of the shared session (concurrent fuels + JS bundle scans reuse warm TLS sockets)
+HTTP_POOL_SIZE = 16
+JS_SCAN_WORKERS = 8
+JS_SCAN_CHUNK_BYTES = 64 * 1024
+JS_SCAN_OVERLAP_BYTES = 4096
 
 OUT_DIR = os.environ.get("OUT_DIR", "./scraping/raw_out")
 LOG_DIR = os.environ.get("LOG_DIR", "./scraping/logs/precodahora")
 
+# Debug only: dump the bootstrap HTML and log cookie names (off on scheduled runs)
+DEBUG_DUMP_HTML = bool(os.environ.get("DEBUG_DUMP_HTML"))
+
+# CSRF token + session cookies are reused across runs until they expire or get rejected.
+# Flask-WTF answers a stale/invalid CSRF token with 400; 401/403 mean the session is gone.
+CSRF_REJECTED_STATUSES = (400, 401, 403)
+CSRF_CACHE_TTL_SECONDS = 30 * 60
+CSRF_CACHE_PATH = os.path.join(
+    OUT_DIR, ".cache", f"csrf_{hashlib.sha1(BASE_URL.encode()).hexdigest()[:12]}.json"
+)
+
 SIGNED_TOKEN_RE = re.compile(r"(Im[A-Za-z0-9_\-]+)\.([A-Za-z0-9_\-]+)\.([A-Za-z0-9_\-]+)")
 
+# All CSRF patterns fused into one alternation: the HTML is scanned once instead of 5 times
+_CSRF_HTML_RE = re.compile(
+    "|".join(
+        f"(?:{p})"
+        for p in (
+            r'<input[^>]+name=["\']csrf_token["\'][^>]+value=["\'](?P<input>[^"\']+)["\']',
+            r'<meta[^>]+name=["\']csrf-token["\'][^>]+content=["\'](?P<meta>[^"\']+)["\']',
+            r'x-csrftoken["\']?\s*[:=]\s*["\'](?P<header>[^"\']+)["\']',
+            r'csrf[_-]?token["\']?\s*[:=]\s*["\'](?P<assign>[^"\']+)["\']',
+            r'csrfToken["\']?\s*[:=]\s*["\'](?P<camel>[^"\']+)["\']',
+        )
+    ),
+    re.IGNORECASE,
+)
+_SIGNED_TOKEN_BYTES_RE = re.compile(SIGNED_TOKEN_RE.pattern.encode("ascii"))
+_SCRIPT_SRC_RE = re.compile(r'<script[^>]+src=["\']([^"\']+)["\']', re.IGNORECASE)
+
+
+class _SlugTable(dict):
+    """str.translate table: safe chars map to themselves, anything else (incl. non-ASCII) to '_'."""
+
+    def __missing__(self, key: int) -> str:
+        return "_"
+
+
+_SLUG_TABLE = _SlugTable((ord(c), c) for c in string.ascii_letters + string.digits + "_-=.")
+
 
 # -----------------------------
 # Logging
@@ -94,9 +166,15 @@ def setup_logger() -> logging.Logger:
 
     fmt = logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s")
 
-    fh = logging.FileHandler(log_path, encoding="utf-8")
+    # file output is buffered (flushed every 256 records, on ERROR and at exit) and the file
+    # is only opened on the first flush; the console handler below still streams every record
+    fh = logging.FileHandler(log_path, encoding="utf-8", delay=True)
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
+    mh = logging.handlers.MemoryHandler(capacity=256, flushLevel=logging.ERROR, target=fh)
+    logger.addHandler(mh)
+    # atexit runs LIFO: flush first, then close
+    atexit.register(mh.close)
+    atexit.register(mh.flush)
 
     ch = logging.StreamHandler()
     ch.setFormatter(fmt)
@@ -116,39 +194,41 @@ def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
-def local_date_yyyy_mm_dd() -> str:
-    return datetime.now().strftime("%Y-%m-%d")
-
-
 def safe_slug(s: str) -> str:
-    return re.sub(r"[^a-zA-Z0-9_\-=\.]", "_", str(s))
+    return str(s).translate(_SLUG_TABLE)
 
 
 def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
-def append_jsonl(path: str, rows: List[Dict[str, Any]]) -> None:
-    with open(path, "a", encoding="utf-8") as f:
-        for row in rows:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+def write_json_atomic(path: str, obj: Any) -> None:
+    # tmp file + os.replace: readers (e.g. Auto Loader) never see a half-written manifest
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    os.replace(tmp, path)
+
+
+def write_jsonl(path: str, lines: Iterable[bytes]) -> int:
+    # lines are already encoded (orjson, UTF-8, newline-terminated) and written as they are
+    # produced, so the page is never held twice in memory; returns the number of rows written
+    count = 0
+    with open(path, "wb") as f:
+        write = f.write
+        for line in lines:
+            write(line)
+            count += 1
+    return count
 
 
 # -----------------------------
 # CSRF discovery
 # -----------------------------
 def extract_csrf_from_html(html: str) -> Optional[str]:
-    patterns = [
-        r'<input[^>]+name=["\']csrf_token["\'][^>]+value=["\']([^"\']+)["\']',
-        r'<meta[^>]+name=["\']csrf-token["\'][^>]+content=["\']([^"\']+)["\']',
-        r'x-csrftoken["\']?\s*[:=]\s*["\']([^"\']+)["\']',
-        r'csrf[_-]?token["\']?\s*[:=]\s*["\']([^"\']+)["\']',
-        r'csrfToken["\']?\s*[:=]\s*["\']([^"\']+)["\']',
-    ]
-    for p in patterns:
-        m = re.search(p, html, flags=re.IGNORECASE)
-        if m:
-            return m.group(1)
+    m = _CSRF_HTML_RE.search(html)
+    if m:
+        return next(v for v in m.groupdict().values() if v)
 
     m = SIGNED_TOKEN_RE.search(html)
     if m:
@@ -158,7 +238,7 @@ def extract_csrf_from_html(html: str) -> Optional[str]:
 
 
 def find_script_srcs(html: str) -> List[str]:
-    srcs = re.findall(r'<script[^>]+src=["\']([^"\']+)["\']', html, flags=re.IGNORECASE)
+    srcs = _SCRIPT_SRC_RE.findall(html)
     urls = [urljoin(BASE_URL, s) for s in srcs]
 
     seen = set()
@@ -170,9 +250,27 @@ def find_script_srcs(html: str) -> List[str]:
     return out
 
 
-def extract_csrf_from_js_text(text: str) -> Optional[str]:
-    m = SIGNED_TOKEN_RE.search(text)
-    return m.group(0) if m else None
+def fetch_js_token(session: requests.Session, url: str, headers: Dict[str, str]) -> Optional[str]:
+    """
+    Streams a JS bundle and stops reading as soon as a signed token shows up,
+    instead of downloading the whole file (bundles can be several MB).
+    """
+    with session.get(url, headers=headers, stream=True, timeout=30) as rr:
+        if rr.status_code != 200:
+            return None
+
+        buf = b""
+        for chunk in rr.iter_content(chunk_size=JS_SCAN_CHUNK_BYTES):
+            buf += chunk
+            m = _SIGNED_TOKEN_BYTES_RE.search(buf)
+            # a match touching the end of the buffer may be cut mid-token: wait for more bytes
+            if m and m.end() < len(buf):
+                return m.group(0).decode("ascii")
+            # keep only the tail (or the partial match) so memory stays bounded
+            buf = buf[m.start():] if m else buf[-JS_SCAN_OVERLAP_BYTES:]
+
+        m = _SIGNED_TOKEN_BYTES_RE.search(buf)
+        return m.group(0).decode("ascii") if m else None
 
 
 def bootstrap_and_find_csrf(session: requests.Session) -> str:
@@ -181,8 +279,9 @@ def bootstrap_and_find_csrf(session: requests.Session) -> str:
     r.raise_for_status()
 
     # Save bootstrap HTML (debug)
-    with open("./scraping/debug_bootstrap.html", "w", encoding="utf-8") as f:
-        f.write(r.text)
+    if DEBUG_DUMP_HTML:
+        with open("./scraping/debug_bootstrap.html", "w", encoding="utf-8") as f:
+            f.write(r.text)
 
     csrf = extract_csrf_from_html(r.text)
     if csrf:
@@ -193,23 +292,154 @@ def bootstrap_and_find_csrf(session: requests.Session) -> str:
     logger.info("CSRF not found in HTML. Scanning %d script bundles...", len(script_urls))
 
     headers = {"User-Agent": UA, "Referer": BASE_URL, "Accept": "*/*"}
+    script_urls = script_urls[:25]
 
-    for url in script_urls[:25]:
-        rr = session.get(url, headers=headers, timeout=30)
-        if rr.status_code != 200:
-            continue
-        token = extract_csrf_from_js_text(rr.text)
-        if token:
-            logger.info("CSRF found in JS bundle: %s", url)
-            return token
-        time.sleep(0.10)
+    if script_urls:
+        # bundles are fetched in parallel; the first one that yields a token wins
+        executor = ThreadPoolExecutor(max_workers=min(JS_SCAN_WORKERS, len(script_urls)))
+        try:
+            futures = {executor.submit(fetch_js_token, session, url, headers): url for url in script_urls}
+            for fut in as_completed(futures):
+                try:
+                    token = fut.result()
+                except requests.RequestException as e:
+                    logger.warning("JS bundle fetch failed (%s): %s", futures[fut], e)
+                    continue
+                if token:
+                    logger.info("CSRF found in JS bundle: %s", futures[fut])
+                    return token
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     raise RuntimeError("CSRF token not found in HTML or JS bundles.")
 
 
+def load_csrf_cache(path: str) -> Optional[Tuple[str, List[Dict[str, Any]], float]]:
+    """Returns (token, cookies, saved_at) if the cache exists and is still fresh."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    saved_at = float(data.get("saved_at", 0))
+    if not data.get("csrf") or time.time() - saved_at > CSRF_CACHE_TTL_SECONDS:
+        return None
+    return data["csrf"], data.get("cookies") or [], saved_at
+
+
+def save_csrf_cache(path: str, csrf: str, session: requests.Session) -> None:
+    ensure_dir(os.path.dirname(path))
+    cookies = [
+        {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+        for c in session.cookies
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"csrf": csrf, "cookies": cookies, "saved_at": time.time()}, f)
+
+
+def drop_csrf_cache(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def get_csrf(session: requests.Session) -> Tuple[str, bool]:
+    """
+    Returns (csrf, from_cache). Reuses the cached token/cookies when fresh,
+    otherwise bootstraps a new session and refreshes the cache.
+    """
+    cached = load_csrf_cache(CSRF_CACHE_PATH)
+    if cached:
+        csrf, cookies, saved_at = cached
+        for c in cookies:
+            session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"])
+        logger.info("Using cached CSRF token (age %.0fs).", time.time() - saved_at)
+        return csrf, True
+
+    csrf = bootstrap_and_find_csrf(session)
+    save_csrf_cache(CSRF_CACHE_PATH, csrf, session)
+    return csrf, False
+
+
 # -----------------------------
 # HTTP with retry/backoff
 # -----------------------------
+class UnauthorizedError(RuntimeError):
+    """400/401/403 from the server: session/CSRF is no longer valid, retrying won't help."""
+
+
+class AdaptiveTokenBucket:
+    """
+    Process-local Adaptive Token Bucket (ATB), shared by all threads.
+
+    - acquire(): blocks until a token is available (and any Retry-After hold has passed)
+    - on_success(): rate += max(delta, alpha * rate), capped at max_rate
+    - on_failure(): rate *= beta (floored at sigma), drops buffered tokens
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float,
+        max_rate: float,
+        sigma: float,
+        delta: float = 0.1,
+        alpha: float = 0.1,
+        beta: float = 0.5,
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_rate = max_rate
+        self.sigma = sigma
+        self.delta = delta
+        self.alpha = alpha
+        self.beta = beta
+        self.tokens = capacity
+        self._last = time.monotonic()
+        self._hold_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self._hold_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return
+                    wait_s = (1.0 - self.tokens) / self.rate
+                else:
+                    wait_s = self._hold_until - now
+            time.sleep(wait_s)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + max(self.delta, self.alpha * self.rate))
+
+    def on_failure(self, hold_s: float = 0.0) -> float:
+        """Registers a 429; hold_s (Retry-After) is a hard floor for every thread. Returns the wait."""
+        with self._lock:
+            now = time.monotonic()
+            self.rate = max(self.sigma, self.rate * self.beta)
+            self.tokens = 0.0
+            self._hold_until = max(self._hold_until, now + hold_s)
+            # refill only starts once the hold is over: no burst of `capacity` requests at its end
+            self._last = max(now, self._hold_until)
+            return max(hold_s, 1.0 / self.rate)
+
+
+RATE_LIMITER = AdaptiveTokenBucket(
+    rate=ATB_INITIAL_RATE,
+    capacity=ATB_CAPACITY,
+    max_rate=ATB_MAX_RATE,
+    sigma=ATB_MIN_RATE,
+)
+
+
 def compute_backoff(attempt: int) -> float:
     # exponential backoff + jitter
     base = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** (attempt - 1)))
@@ -217,41 +447,64 @@ def compute_backoff(attempt: int) -> float:
     return min(MAX_BACKOFF_SECONDS, base + jitter)
 
 
+def parse_retry_after(retry_after: Optional[str], attempt: int) -> float:
+    """
+    Seconds to wait from a Retry-After header (RFC 7231: delay-seconds or HTTP-date).
+    Missing header -> 0 (the token bucket paces alone); unparsable -> exponential backoff.
+    """
+    if not retry_after:
+        return 0.0
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        dt = parsedate_to_datetime(retry_after)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return compute_backoff(attempt)
+
+
 def request_with_retry(
     method: str,
     session: requests.Session,
     url: str,
     *,
     headers: Optional[Dict[str, str]] = None,
-    data: Optional[Dict[str, Any]] = None,
+    data: Union[str, Dict[str, Any], None] = None,
     timeout: int = 30
 ) -> requests.Response:
     last_err: Optional[Exception] = None
 
     for attempt in range(1, MAX_RETRIES + 1):
         try:
+            RATE_LIMITER.acquire()
             r = session.request(method, url, headers=headers, data=data, timeout=timeout)
 
             if r.status_code == 429:
-                retry_after = r.headers.get("Retry-After")
-                if retry_after and retry_after.isdigit():
-                    wait_s = float(retry_after)
-                else:
-                    wait_s = compute_backoff(attempt)
-
-                logger.warning("429 rate limit. attempt %d/%d. waiting %.1fs", attempt, MAX_RETRIES, wait_s)
-                time.sleep(wait_s)
+                hold_s = parse_retry_after(r.headers.get("Retry-After"), attempt)
+
+                # the bucket paces the next attempt (and every other thread); no local sleep
+                wait_s = RATE_LIMITER.on_failure(hold_s)
+                logger.warning(
+                    "429 rate limit. attempt %d/%d. waiting ~%.1fs (rate now %.2f req/s)",
+                    attempt, MAX_RETRIES, wait_s, RATE_LIMITER.rate,
+                )
                 continue
 
-            # If unauthorized, don't endlessly retry unless it might be transient
-            if r.status_code == 401:
+            # Token/session rejected: retrying with the same CSRF won't help
+            if r.status_code in CSRF_REJECTED_STATUSES:
                 snippet = (r.text or "")[:300].replace("\n", " ")
-                raise RuntimeError(f"401 unauthorized. snippet={snippet}")
+                raise UnauthorizedError(f"{r.status_code} token rejected. snippet={snippet}")
 
             # Raise for other errors (4xx/5xx)
             r.raise_for_status()
+            RATE_LIMITER.on_success()
             return r
 
+        except UnauthorizedError:
+            raise
         except Exception as e:
             last_err = e
             wait_s = compute_backoff(attempt)
@@ -261,7 +514,12 @@ def request_with_retry(
     raise RuntimeError(f"Request failed after {MAX_RETRIES} retries. last_error={last_err}")
 
 
-def post_products(session: requests.Session, csrf: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+def build_payload(anp: str) -> str:
+    """Urlencoded form body for one fuel (page 1); requests sends a str body verbatim."""
+    return f"{_PAYLOAD_STATIC}&anp={quote_plus(anp)}"
+
+
+def post_products(session: requests.Session, csrf: str, payload: str) -> Dict[str, Any]:
     headers = {
         "User-Agent": UA,
         "Accept": "*/*",
@@ -276,7 +534,7 @@ def post_products(session: requests.Session, csrf: str, payload: Dict[str, Any])
 
     # Parse JSON safely
     try:
-        return r.json()
+        return orjson.loads(r.content)
     except Exception:
         snippet = (r.text or "")[:500].replace("\n", " ")
         raise RuntimeError(f"Response is not JSON. snippet={snippet}")
@@ -285,8 +543,7 @@ def post_products(session: requests.Session, csrf: str, payload: Dict[str, Any])
 # -----------------------------
 # Output layout (Databricks-friendly)
 # -----------------------------
-def make_out_paths(base_out: str, anp: str, run_id: str) -> Dict[str, str]:
-    dt = local_date_yyyy_mm_dd()
+def make_out_paths(base_out: str, anp: str, run_id: str, dt: str) -> Dict[str, str]:
     root = os.path.join(
         base_out,
         "source=precodahora",
@@ -308,20 +565,23 @@ def page_to_rows(
     anp: str,
     query_meta: Dict[str, Any],
     data: Dict[str, Any],
-) -> List[Dict[str, Any]]:
-    rows = []
+) -> Iterator[bytes]:
     results = data.get("resultado") or []
 
+    # every row shares the same leading fields: serialize them once and only encode `raw` per item
+    prefix = orjson.dumps({
+        "collected_at_utc": collected_at_utc,
+        "run_id": run_id,
+        "source": "precodahora",
+        "anp": anp,
+        "query": query_meta,
+    })[:-1] + b',"raw":'
+
+    # local bindings keep the per-item loop free of global/attribute lookups
+    dumps = orjson.dumps
+    suffix = b"}\n"
     for item in results:
-        rows.append({
-            "collected_at_utc": collected_at_utc,
-            "run_id": run_id,
-            "source": "precodahora",
-            "anp": anp,
-            "query": query_meta,
-            "raw": item,
-        })
-    return rows
+        yield prefix + dumps(item) + suffix
 
 
 def collect_one_page_per_fuel(
@@ -329,28 +589,13 @@ def collect_one_page_per_fuel(
     csrf: str,
     base_out: str,
     anp: str,
+    collected_at: str,
+    dt: str,
 ) -> Dict[str, Any]:
     run_id = str(uuid.uuid4())
-    paths = make_out_paths(base_out, anp, run_id)
-
-    collected_at = utc_now_iso()
-
-    # overwrite file for safety
-    if os.path.exists(paths["data_jsonl"]):
-        os.remove(paths["data_jsonl"])
-
-    payload = {
-        "horas": str(HORAS),
-        "anp": anp,
-        "latitude": str(LATITUDE),
-        "longitude": str(LONGITUDE),
-        "raio": str(RAIO),
-        "pagina": "1",              # only page 1
-        "ordenar": ORDENAR,
-    }
 
     logger.info("%s: fetching page 1 (only) ...", anp)
-    data = post_products(session, csrf, payload)
+    data = post_products(session, csrf, build_payload(anp))
 
     # sanity checks
     total_pages = int(data.get("totalPaginas", 1))
@@ -361,7 +606,12 @@ def collect_one_page_per_fuel(
     if not isinstance(results, list):
         raise RuntimeError("Unexpected response format: 'resultado' is not a list.")
 
-    rows = page_to_rows(
+    # the partition dir is only created once there is a valid page to write: a rejected
+    # token or a bad response must not leave an empty run_id=... directory behind
+    paths = make_out_paths(base_out, anp, run_id, dt)
+
+    # lazy: each line is encoded and written in the same pass
+    lines = page_to_rows(
         collected_at_utc=collected_at,
         run_id=run_id,
         anp=anp,
@@ -375,8 +625,7 @@ def collect_one_page_per_fuel(
         },
         data=data,
     )
-
-    append_jsonl(paths["data_jsonl"], rows)
+    rows_written = write_jsonl(paths["data_jsonl"], lines)
 
     manifest = {
         "run_id": run_id,
@@ -397,29 +646,38 @@ def collect_one_page_per_fuel(
             "totalPaginas_reported": total_pages,
             "totalRegistros_reported": total_registros,
             "registrosdaPagina_reported": page_count,
-            "rows_written": len(rows),
+            "rows_written": rows_written,
         },
     }
 
-    with open(paths["manifest"], "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    write_json_atomic(paths["manifest"], manifest)
 
-    logger.info("%s: wrote %d rows (page 1) -> %s", anp, len(rows), paths["data_jsonl"])
+    logger.info("%s: wrote %d rows (page 1) -> %s", anp, rows_written, paths["data_jsonl"])
     return manifest
 
 
 def main():
     ensure_dir(OUT_DIR)
 
+    # one clock read per run: every fuel shares collected_at and the dt= partition,
+    # even if the run crosses midnight
+    run_started = datetime.now(timezone.utc)
+    collected_at = run_started.isoformat(timespec="seconds")
+    dt_str = run_started.astimezone().strftime("%Y-%m-%d")
+
     session = requests.Session()
     session.headers.update({
         "User-Agent": UA,
         "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
         "Connection": "keep-alive",
     })
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, pool_block=False)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
 
-    csrf = bootstrap_and_find_csrf(session)
-    logger.info("Cookies received: %s", list(session.cookies.keys()))
+    csrf, from_cache = get_csrf(session)
+    if DEBUG_DUMP_HTML:
+        logger.info("Cookies received: %s", list(session.cookies.keys()))
     logger.info("CSRF token found: %s", "yes" if csrf else "no")
 
     overall = {
@@ -428,20 +686,35 @@ def main():
         "runs": [],
     }
 
-    for idx, anp in enumerate(FUELS, start=1):
+    pending = list(FUELS)
+    if from_cache:
+        # the first fuel doubles as a probe for the cached token
         try:
-            manifest = collect_one_page_per_fuel(session, csrf, OUT_DIR, anp)
-            overall["runs"].append(manifest)
-        finally:
-            # polite delay between fuels to reduce 429 risk
-            if idx < len(FUELS):
-                sleep_s = random.uniform(*SLEEP_BETWEEN_FUELS)
-                logger.info("Sleeping %.2fs before next fuel...", sleep_s)
-                time.sleep(sleep_s)
+            overall["runs"].append(collect_one_page_per_fuel(
+                session, csrf, OUT_DIR, pending[0], collected_at, dt_str
+            ))
+            pending = pending[1:]
+        except UnauthorizedError as e:
+            logger.info("Cached CSRF token rejected (%s). Bootstrapping a new session...", e)
+            drop_csrf_cache(CSRF_CACHE_PATH)
+            session.cookies.clear()
+            csrf = bootstrap_and_find_csrf(session)
+            save_csrf_cache(CSRF_CACHE_PATH, csrf, session)
+        except Exception:
+            # don't let the next scheduled runs keep reusing a token we couldn't validate
+            drop_csrf_cache(CSRF_CACHE_PATH)
+            raise
+
+    def collect(anp: str) -> Dict[str, Any]:
+        time.sleep(random.uniform(*FUEL_START_JITTER))
+        return collect_one_page_per_fuel(session, csrf, OUT_DIR, anp, collected_at, dt_str)
+
+    # network-bound: one thread per fuel, results kept in FUELS order
+    with ThreadPoolExecutor(max_workers=FUEL_CONCURRENCY) as executor:
+        overall["runs"].extend(executor.map(collect, pending))
 
     overall_path = os.path.join(OUT_DIR, "overall_manifest.json")
-    with open(overall_path, "w", encoding="utf-8") as f:
-        json.dump(overall, f, ensure_ascii=False, indent=2)
+    write_json_atomic(overall_path, overall)
 
     logger.info("Overall manifest saved: %s", overall_path)
     logger.info("Run completed successfully.")